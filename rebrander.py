@@ -0,0 +1,685 @@
+# Rebranding engine behind app.py: text mappings and logo matching for docx, pptx and xlsx.
+# Kept out of the Streamlit script so worker processes (and pickle) see the same module and
+# classes on every rerun; Streamlit re-executes app.py as a fresh __main__ each time.
+import streamlit as st
+from io import BytesIO, StringIO
+from pathlib import Path
+from pptx import Presentation
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+from pptx.opc.serialized import PackageWriter
+import zipfile
+from lxml import etree
+from xml.sax.saxutils import escape as xml_escape
+from PIL import Image
+import numpy as np
+import csv
+import functools
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from contextlib import closing
+from types import SimpleNamespace
+from typing import NamedTuple
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import numba
+except ImportError:  # optional: min_hamming falls back to NumPy
+    numba = None
+
+try:
+    import pyvips
+except (ImportError, OSError):  # optional: needs libvips; wmf_to_png_blob falls back to the CLI
+    pyvips = None
+
+try:
+    from wand.image import Image as WandImage
+except ImportError:  # optional: needs MagickWand; wmf_to_png_blob falls back to the CLI
+    WandImage = None
+
+# Identical WMFs (a logo repeated across headers, or across uploads) convert once per process
+@functools.lru_cache(maxsize=32)
+def wmf_to_png_blob(wmf_blob: bytes) -> bytes:
+    # convert in-process via libvips (WMF goes through its ImageMagick loader)
+    if pyvips is not None:
+        try:
+            img = pyvips.Image.new_from_buffer(wmf_blob, "", access="sequential")
+            return img.write_to_buffer(".png[compression=6]")
+        except pyvips.Error:
+            pass  # this libvips build can't load WMF
+    # or in-process via MagickWand
+    if WandImage is not None:
+        try:
+            with WandImage(blob=wmf_blob, format="wmf") as img:
+                img.format = "png"
+                return img.make_blob()
+        except Exception:
+            pass  # no WMF delegate in this ImageMagick build
+    # otherwise via the ImageMagick CLI, piped through stdin/stdout
+    return subprocess.run(["convert", "wmf:-", "png:-"], input=wmf_blob, capture_output=True, check=True).stdout
+
+# Directory containing old logos (relative to this script)
+OLD_LOGO_DIR = Path(__file__).parent / "old_logos"
+# Hamming distance threshold for perceptual hash matching
+HASH_THRESHOLD = 25
+# Persistent phash cache, blob_digest(image bytes) -> packed phash, shared across runs
+PHASH_DB = Path(__file__).parent / ".phash_cache.sqlite3"
+# Embedded images more than this many times the largest old logo's width/height (by pixel
+# count) are taken for photos and never phashed. Byte size says little (a rescaled or
+# re-encoded logo still matches), so this is the only size gate.
+SCALE_LIMIT = 8
+
+# Threads phash_many decodes images on by default; rebrand_file lowers it when several
+# files are rebranded at once in worker processes, so the batch doesn't oversubscribe the cores
+PHASH_THREADS = os.cpu_count() or 1
+
+# State of the rebrand_file call running on this thread. In-process runs happen on each
+# session's script thread, so it can't be module-global:
+#   debug_log: debug lines, collected (only when debugging is on) and shown in one block
+#              after a run instead of one st.write round-trip to the browser per image
+#   phash_threads: overrides PHASH_THREADS
+RUN = threading.local()
+
+def debug(msg: str):
+    log = getattr(RUN, "debug_log", None)
+    if log is not None:
+        log.append(msg)
+
+# Identity of an image's exact bytes: keys the exact-match checks and the phash caches
+def blob_digest(blob: bytes) -> bytes:
+    return hashlib.blake2b(blob, digest_size=16).digest()
+
+# Reference data for the old logos
+class OldLogos(NamedTuple):
+    hashes: np.ndarray    # distinct packed 64-bit phash digests (uint64)
+    digests: frozenset    # blob_digest of each logo file, for exact-match short-circuit
+    max_pixels: int       # pixel count of the largest logo
+    new_hash: int = None                  # phash of this run's new logo (see with_new_logo)
+    new_digests: frozenset = frozenset()  # blob_digest of each encoded new-logo variant
+
+# Rows 0-7 of the unnormalised 32-point DCT-II basis (scipy.fft.dct's scaling): phash only
+# keeps the low 8x8 block, so D @ pixels @ D.T yields exactly those coefficients for a
+# fraction of the cost of a full 32x32 transform
+DCT_LOW = (2 * np.cos(np.pi * np.arange(8)[:, None] * (2 * np.arange(32) + 1) / 64)).astype(np.float32)
+
+# 32x32 greyscale pixels that phash is computed from.
+# draft() lets libjpeg decode straight to greyscale at a reduced scale; for other formats
+# reducing_gap box-reduces large images to ~64x64 first, so LANCZOS only filters that.
+def phash_pixels(img: Image.Image) -> np.ndarray:
+    img.draft("L", (32, 32))
+    return np.asarray(img.convert("L").resize((32, 32), Image.LANCZOS, reducing_gap=2.0), dtype=np.float32)
+
+# 64-bit perceptual hashes of a (B, 32, 32) stack of pixels, one uint64 per image (the
+# algorithm and bit order of imagehash.phash: 2-D DCT-II, low 8x8 block against its median).
+# The whole batch goes through one pair of matmuls.
+def phash_batch(pixels: np.ndarray) -> np.ndarray:
+    low = (DCT_LOW @ pixels @ DCT_LOW.T).reshape(len(pixels), 64)
+    bits = np.packbits(low > np.median(low, axis=1, keepdims=True), axis=1)
+    return bits.view(">u8").ravel().astype(np.uint64)
+
+# PIL format to open an embedded image with, from its leading bytes, so Image.open doesn't
+# probe every plugin; anything else (None) is left to PIL to identify
+IMAGE_SIGNATURES = {b"\x89PNG": ("PNG",), b"\xff\xd8\xff": ("JPEG",), b"GIF8": ("GIF",)}
+
+def open_image(blob: bytes) -> Image.Image:
+    formats = next((f for sig, f in IMAGE_SIGNATURES.items() if blob.startswith(sig)), None)
+    return Image.open(BytesIO(blob), formats=formats)
+
+# Pixel count of an image file, from its header alone (PIL opens images lazily), or None
+# if PIL can't identify it
+def image_pixels(fp):
+    try:
+        with Image.open(fp) as img:
+            return img.width * img.height
+    except Exception:
+        return None
+
+# Packed phash of a single image
+def fast_phash(img: Image.Image) -> int:
+    return int(phash_batch(phash_pixels(img)[None])[0])
+
+# Numba kernel for min_hamming: one XOR + SWAR popcount per (hash, old logo) pair, no
+# temporaries. Compiled (and warmed) once per process rather than on the first image of a run.
+@st.cache_resource(show_spinner=False)
+def compile_min_hamming():
+    m1, m2, m4, h01 = (np.uint64(c) for c in (
+        0x5555555555555555, 0x3333333333333333, 0x0F0F0F0F0F0F0F0F, 0x0101010101010101))
+    s1, s2, s4, s56 = (np.uint64(c) for c in (1, 2, 4, 56))
+
+    @numba.njit(cache=True)
+    def kernel(hashes, old_hashes):
+        out = np.empty(hashes.shape[0], dtype=np.uint64)
+        for j in range(hashes.shape[0]):
+            h = hashes[j]
+            best = np.uint64(64)
+            for i in range(old_hashes.shape[0]):
+                x = old_hashes[i] ^ h
+                x = x - ((x >> s1) & m1)
+                x = (x & m2) + ((x >> s2) & m2)
+                x = (((x + (x >> s4)) & m4) * h01) >> s56
+                if x < best:
+                    best = x
+            out[j] = best
+        return out
+
+    kernel(np.zeros(1, dtype=np.uint64), np.zeros(1, dtype=np.uint64))
+    return kernel
+
+min_hamming_kernel = compile_min_hamming() if numba is not None else None
+
+# Minimum Hamming distance from each packed hash to any of the packed old-logo hashes,
+# as an array (None if there are no old logos)
+def min_hamming(hashes: np.ndarray, old_hashes: np.ndarray):
+    if old_hashes.size == 0:
+        return None
+    if min_hamming_kernel is not None:
+        return min_hamming_kernel(hashes, old_hashes)
+    x = np.bitwise_xor(hashes[:, None], old_hashes[None, :])
+    if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+        return np.bitwise_count(x).min(axis=1)
+    return np.unpackbits(x.view(np.uint8)).reshape(*x.shape, 64).sum(axis=2).min(axis=1)
+
+# (name, mtime) snapshot of the old logos; used as the cache key below
+def old_logo_signature():
+    if not OLD_LOGO_DIR.is_dir():
+        return ()
+    with os.scandir(OLD_LOGO_DIR) as entries:
+        return tuple(sorted((e.name, e.stat().st_mtime_ns) for e in entries if e.is_file()))
+
+# Load and hash old logos once per process, phashes packed into a uint64 array.
+# Streamlit re-hashes only when the signature changes (a logo was added/edited), and
+# unchanged logos come out of PHASH_DB, so a restart doesn't decode them again.
+@st.cache_resource(show_spinner=False)
+def load_old_logo_hashes(signature: tuple = ()):
+    blobs = {}
+    if OLD_LOGO_DIR.exists() and OLD_LOGO_DIR.is_dir():
+        for img_path in OLD_LOGO_DIR.iterdir():
+            if img_path.suffix.lower() in {".png", ".jpg", ".jpeg"}:
+                blob = img_path.read_bytes()
+                blobs[blob] = blob_digest(blob)
+    logo_hashes, digests, pixels = [], set(), []
+    for blob, h in cached_phashes(blobs).items():
+        if isinstance(h, Exception):
+            continue
+        logo_hashes.append(h)
+        digests.add(blobs[blob])
+        pixels.append(image_pixels(BytesIO(blob)))
+    return OldLogos(
+        hashes=np.unique(np.asarray(logo_hashes, dtype=np.uint64)),
+        digests=frozenset(digests),
+        max_pixels=max(pixels, default=0),
+    )
+
+# Packed phash of each blob. Decoding and resizing run on a thread pool (PIL releases
+# the GIL); the DCTs of all decoded images then run as one batch.
+# Returns {blob: packed phash, or the exception decoding it raised}.
+def phash_many(blobs: list) -> dict:
+    def safe_pixels(blob):
+        try:
+            return phash_pixels(open_image(blob))
+        except Exception as e:
+            return e
+    threads = getattr(RUN, "phash_threads", PHASH_THREADS)
+    if len(blobs) <= 1 or threads <= 1:
+        decoded = [safe_pixels(blob) for blob in blobs]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            decoded = list(pool.map(safe_pixels, blobs))
+    results = {blob: px for blob, px in zip(blobs, decoded) if isinstance(px, Exception)}
+    ok = [(blob, px) for blob, px in zip(blobs, decoded) if not isinstance(px, Exception)]
+    if ok:
+        hashes = phash_batch(np.stack([px for _, px in ok]))
+        results.update((blob, int(h)) for (blob, _), h in zip(ok, hashes))
+    return results
+
+# Phashes already looked up in this process, {digest: packed phash}, so images seen in an
+# earlier document or run skip PHASH_DB too. Shared by every session thread, hence the
+# lock; least recently used entries are dropped past `size`.
+class PhashMemo:
+    def __init__(self, size: int):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    # {blob: phash} for the {blob: digest} candidates already memoised
+    def get_many(self, candidates: dict) -> dict:
+        hits = {}
+        with self.lock:
+            for blob, digest in candidates.items():
+                h = self.entries.get(digest)
+                if h is not None:
+                    self.entries.move_to_end(digest)
+                    hits[blob] = h
+        return hits
+
+    def put_many(self, items):
+        with self.lock:
+            for digest, h in items:
+                self.entries[digest] = h
+                self.entries.move_to_end(digest)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+PHASH_MEMO_SIZE = 4096
+
+@st.cache_resource(show_spinner=False)
+def phash_memo() -> PhashMemo:
+    return PhashMemo(PHASH_MEMO_SIZE)
+
+# Packed phashes for {blob: blob_digest}. Hits come from phash_memo, then PHASH_DB;
+# misses are computed with phash_many and written back in one transaction. The database
+# is best effort: if it can't be used, misses are simply recomputed.
+def cached_phashes(candidates: dict) -> dict:
+    memo = phash_memo()
+    hashes = memo.get_many(candidates)
+    try:
+        if len(hashes) < len(candidates):
+            with closing(sqlite3.connect(PHASH_DB)) as db:
+                db.execute("CREATE TABLE IF NOT EXISTS phash_b2 (digest BLOB PRIMARY KEY, hash BLOB)")
+                for blob, digest in candidates.items():
+                    if blob in hashes:
+                        continue
+                    row = db.execute("SELECT hash FROM phash_b2 WHERE digest = ?", (digest,)).fetchone()
+                    if row:
+                        hashes[blob] = int.from_bytes(row[0], "big")
+                misses = phash_many([blob for blob in candidates if blob not in hashes])
+                hashes.update(misses)
+                with db:
+                    db.executemany(
+                        "INSERT OR REPLACE INTO phash_b2 (digest, hash) VALUES (?, ?)",
+                        [(candidates[blob], h.to_bytes(8, "big"))
+                         for blob, h in misses.items() if not isinstance(h, Exception)],
+                    )
+    except sqlite3.Error as e:
+        debug(f"phash cache unavailable: {e}")
+        hashes.update(phash_many([blob for blob in candidates if blob not in hashes]))
+    memo.put_many((candidates[blob], h) for blob, h in hashes.items() if not isinstance(h, Exception))
+    return hashes
+
+# Whether an image of `pixels` pixels could be an old logo at all (see SCALE_LIMIT).
+# Images PIL can't identify (None) are let through, for phashing to report.
+def could_be_logo(pixels, old_logos: OldLogos) -> bool:
+    return pixels is None or pixels <= old_logos.max_pixels * SCALE_LIMIT ** 2
+
+# Min Hamming distance from each distinct embedded image to the old logos.
+# Byte-identical copies match at 0 without decoding; images whose pixel size rules them
+# out are None without decoding; the rest are phashed. Returns {blob: distance, or the
+# exception decoding it raised}. Callers mutate the document afterwards on their thread.
+def match_all(blobs, old_logos: OldLogos) -> dict:
+    results, candidates = {}, {}
+    for blob in dict.fromkeys(blobs):
+        digest = blob_digest(blob)
+        if digest in old_logos.new_digests:
+            results[blob] = None  # already the new logo
+        elif digest in old_logos.digests:
+            results[blob] = 0
+        elif could_be_logo(image_pixels(BytesIO(blob)), old_logos):
+            candidates[blob] = digest
+        else:
+            results[blob] = None
+    hashes = {}
+    for blob, h in cached_phashes(candidates).items():
+        if isinstance(h, Exception):
+            results[blob] = h
+        else:
+            hashes[blob] = h
+    if not hashes:
+        return results
+    # all distances in one call, on the packed uint64 hashes
+    packed = np.fromiter(hashes.values(), dtype=np.uint64, count=len(hashes))
+    dists = min_hamming(packed, old_logos.hashes)
+    new_dists = None
+    if old_logos.new_hash is not None:
+        new_dists = min_hamming(packed, np.array([old_logos.new_hash], dtype=np.uint64))
+    for i, blob in enumerate(hashes):
+        dist = None if dists is None else int(dists[i])
+        # looks more like the new logo than any old one: leave it alone
+        if dist is not None and new_dists is not None and new_dists[i] < dist:
+            dist = None
+        results[blob] = dist
+    return results
+
+# Attach the new logo's phash and digests, computed once per run, so images that already
+# are the new logo (e.g. a second pass over a rebranded file) are never replaced again
+def with_new_logo(old_logos: OldLogos, new_logos: dict) -> OldLogos:
+    png = new_logos["image/png"]
+    new_hash = cached_phashes({png: blob_digest(png)})[png]
+    return old_logos._replace(
+        new_hash=None if isinstance(new_hash, Exception) else new_hash,
+        new_digests=frozenset(blob_digest(blob) for blob in new_logos.values()),
+    )
+
+# Image modes PIL can write as PNG without converting
+PNG_MODES = {"1", "L", "LA", "I", "I;16", "P", "RGB", "RGBA"}
+
+# The new logo encoded once per replaceable format, keyed by content type, so a replaced
+# image part keeps its original MIME type and partname extension. The upload's own bytes
+# are used as-is for its native format; other formats (WMF, GIF, ...) fall back to PNG.
+# Cached per upload, so re-running with the same logo doesn't re-encode it.
+@st.cache_data(show_spinner=False, max_entries=8)
+def logo_variants(new_logo_bytes: bytes) -> dict:
+    img = Image.open(BytesIO(new_logo_bytes))
+    native = Image.MIME.get(img.format)
+    variants = {}
+    # a variant that can't be encoded falls back to the upload's bytes, as they were
+    # always written before there were variants
+    if native != "image/png":
+        try:
+            png = img if img.mode in PNG_MODES else img.convert("RGBA")  # e.g. CMYK JPEGs
+            buf = BytesIO()
+            png.save(buf, "PNG", optimize=True)
+            variants["image/png"] = buf.getvalue()
+        except Exception:
+            variants["image/png"] = new_logo_bytes
+    if native != "image/jpeg":
+        try:
+            flat = img.convert("RGBA")
+            background = Image.new("RGB", flat.size, (255, 255, 255))  # JPEG has no alpha
+            background.paste(flat, mask=flat.getchannel("A"))
+            buf = BytesIO()
+            background.save(buf, "JPEG", quality=90)
+            variants["image/jpeg"] = buf.getvalue()
+        except Exception:
+            variants["image/jpeg"] = new_logo_bytes
+    if native in ("image/png", "image/jpeg"):
+        variants[native] = new_logo_bytes
+    return variants
+
+# (content type, blob) of the new logo to write over an image part of `content_type`
+def pick_logo(new_logos: dict, content_type: str):
+    if content_type not in new_logos:
+        content_type = "image/png"
+    return content_type, new_logos[content_type]
+
+# Parse the "find,replace" lines of the mapping text box; cached per text, so widget
+# reruns don't re-parse it. csv rules: quote a find text that contains a comma;
+# unquoted extra commas stay in the replacement.
+@st.cache_data(show_spinner=False, max_entries=16)
+def parse_mappings(mapping_text: str) -> dict:
+    return {
+        row[0]: ",".join(row[1:])
+        for row in csv.reader(StringIO(mapping_text)) if len(row) >= 2 and row[0].strip()
+    }
+
+# Compile find → replace mappings into one regex alternation (longest keys first,
+# so "Aecon Group Inc." wins over "Aecon") plus the matching substitution callback
+def compile_mappings(mappings: dict):
+    keys = sorted((k for k in mappings if k), key=len, reverse=True)
+    pattern = "|".join(re.escape(k) for k in keys) or r"(?!)"  # never matches
+    lookup = mappings.__getitem__
+    return re.compile(pattern), lambda m: lookup(m[0])
+
+# Byte-level search for any mapping key as it appears in a serialised XML part (UTF-8,
+# with &, < and > escaped), so parts that can't contain a match skip the lxml round-trip
+def compile_raw_search(mappings: dict):
+    keys = sorted((k for k in mappings if k), key=len, reverse=True)
+    pattern = b"|".join(re.escape(xml_escape(k).encode()) for k in keys) or rb"(?!)"
+    return re.compile(pattern).search
+
+# Process .pptx files with perceptual hash image replacement and debug info (no scaling)
+def process_pptx(uploaded_file, mappings: dict, new_logos: dict, old_logos: OldLogos):
+    prs = Presentation(uploaded_file)
+    pat, repl = compile_mappings(mappings)
+    pictures = []
+    for slide_idx, slide in enumerate(prs.slides, start=1):
+        # Text replacement, straight on the slide's <a:t> runs (tables and groups included)
+        replace_element_text(PPTX_TEXT_NODES(slide.element), pat, repl)
+        # Collect pictures; they are hashed together below
+        for shape in slide.shapes:
+            if shape.shape_type == MSO_SHAPE_TYPE.PICTURE:
+                try:
+                    image_part = slide.part.related_part(shape._element.blip_rId)
+                    pictures.append((slide_idx, shape, image_part, image_part.blob))
+                except Exception as e:
+                    debug(f"Error processing PPTX slide {slide_idx} image: {e}")
+
+    # Image replacement (python-pptx tree edits stay on this thread)
+    distances = match_all((blob for *_, blob in pictures), old_logos)
+    replaced = set()
+    for slide_idx, shape, image_part, blob in pictures:
+        min_dist = distances[blob]
+        if isinstance(min_dist, Exception):
+            debug(f"Error processing PPTX slide {slide_idx} image: {min_dist}")
+            continue
+        debug(f"PPTX slide {slide_idx} image - min Hamming distance: {min_dist}")
+        if min_dist is not None and min_dist <= HASH_THRESHOLD:
+            debug(f"Replacing PPTX slide {slide_idx} image (distance {min_dist})")
+            # overwrite the image part in place (once, however many pictures share it):
+            # the picture keeps its rId, position and size, and the shape tree is untouched
+            if image_part.partname not in replaced:
+                image_part._content_type, image_part._blob = pick_logo(new_logos, image_part.content_type)
+                replaced.add(image_part.partname)
+            # only touch the crop when there is one (the setters add an <a:srcRect> otherwise)
+            if shape.crop_left or shape.crop_top or shape.crop_right or shape.crop_bottom:
+                shape.crop_left = shape.crop_top = shape.crop_right = shape.crop_bottom = 0
+    output = BytesIO()
+    package = prs.part.package
+    PptxPackageWriter.write(output, package._rels, tuple(package.iter_parts()))
+    output.seek(0)
+    return output
+
+# ZIP archive for writing OOXML packages: deflate level 1 for the XML parts, and media
+# (already PNG/JPEG-compressed) stored as-is instead of being deflated again
+class PackageArchive(zipfile.ZipFile):
+    def __init__(self, file):
+        super().__init__(file, "w", zipfile.ZIP_DEFLATED, allowZip64=True, compresslevel=1)
+
+    def writestr(self, zinfo_or_arcname, data, compress_type=None, compresslevel=None):
+        if isinstance(zinfo_or_arcname, str) and "/media/" in zinfo_or_arcname:
+            compress_type = zipfile.ZIP_STORED
+        super().writestr(zinfo_or_arcname, data, compress_type=compress_type, compresslevel=compresslevel)
+
+    # Copy entry `info` of `source` unchanged, streamed through copyfileobj's fixed-size
+    # buffer instead of being read whole (media stored, as in writestr)
+    def copy_entry(self, source: zipfile.ZipFile, info: zipfile.ZipInfo):
+        name = info.filename
+        if "/media/" in name:
+            name = zipfile.ZipInfo(name, info.date_time)
+            name.compress_type = zipfile.ZIP_STORED
+        with source.open(info) as src, self.open(name, "w", force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as dst:
+            shutil.copyfileobj(src, dst)
+
+# python-pptx's package writer, saving through PackageArchive rather than deflating every
+# part (media included) at zlib's default level
+class PptxPackageWriter(PackageWriter):
+    def _write(self):
+        with PackageArchive(self._pkg_file) as zf:
+            phys_writer = SimpleNamespace(write=lambda pack_uri, blob: zf.writestr(pack_uri.membername, blob))
+            self._write_content_types_stream(phys_writer)
+            self._write_pkg_rels(phys_writer)
+            self._write_parts(phys_writer)
+
+CT_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+SML_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+WML_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+DML_NS = "http://schemas.openxmlformats.org/drawingml/2006/main"
+SML_T = f"{{{SML_NS}}}t"
+WML_T = f"{{{WML_NS}}}t"
+XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+# Text elements whose schema allows xml:space (DrawingML's <a:t> doesn't, and keeps
+# whitespace anyway)
+XML_SPACE_TAGS = {WML_T, SML_T}
+DCTERMS_MODIFIED = "{http://purl.org/dc/terms/}modified"
+# Parser for XML parts of uploaded files: like python-docx/python-pptx's oxml parser, it
+# never resolves entities, so a part can't pull server files into the output (lxml < 5
+# resolves external entities by default)
+XML_PARSER = etree.XMLParser(resolve_entities=False)
+
+# Text runs of a pptx slide (shapes, tables and groups alike)
+PPTX_TEXT_NODES = etree.XPath("//a:t", namespaces={"a": DML_NS})
+
+# MIME type of a media part, from its extension ("" if PIL doesn't know it)
+def media_content_type(partname: str) -> str:
+    return Image.MIME.get(Image.registered_extensions().get(os.path.splitext(partname)[1].lower()), "")
+
+# Apply the mappings to the text of each element in `elements`, in place.
+# Returns whether anything changed.
+def replace_element_text(elements, pat: re.Pattern, repl) -> bool:
+    search, sub = pat.search, pat.sub
+    changed = False
+    for el in elements:
+        text = el.text
+        if text and search(text):
+            el.text = text = sub(repl, text)
+            if (text[:1].isspace() or text[-1:].isspace()) and el.tag in XML_SPACE_TAGS:
+                el.set(XML_SPACE, "preserve")
+            changed = True
+    return changed
+
+# Apply the mappings to the text of the elements `text_nodes` selects in an XML part.
+# Returns the re-serialised part, or None if nothing changed.
+def replace_xml_text(data: bytes, text_nodes, pat: re.Pattern, repl):
+    root = etree.fromstring(data, XML_PARSER)
+    if not replace_element_text(text_nodes(root), pat, repl):
+        return None
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+# Match a package's media parts {partname: blob} against the old logos.
+# Returns {partname: new blob} to write, and {partname: content type} for replacements
+# whose format differs from the part's extension (they need a [Content_Types] override).
+def replace_media(media: dict, old_logos: OldLogos, new_logos: dict, label: str):
+    raws = {}
+    for name, blob in media.items():
+        if name.lower().endswith(".wmf"):
+            try:
+                blob = wmf_to_png_blob(blob)
+                debug(f"Converted WMF '{name}' → PNG")
+            except Exception as e:
+                debug(f"WMF→PNG failed for '{name}': {e}")
+                continue
+        raws[name] = blob
+
+    distances = match_all(raws.values(), old_logos)
+    replacements, overrides = {}, {}
+    for name, raw in raws.items():
+        min_dist = distances[raw]
+        if isinstance(min_dist, Exception):
+            debug(f"Error processing {label} image '{name}': {min_dist}")
+            continue
+        debug(f"{label} image '{name}' - min Hamming distance: {min_dist}")
+        if min_dist is not None and min_dist <= HASH_THRESHOLD:
+            debug(f"Replacing {label} image '{name}' (distance {min_dist})")
+            content_type = media_content_type(name)
+            new_type, replacements[name] = pick_logo(new_logos, content_type)
+            if new_type != content_type:
+                overrides[name] = new_type
+    return replacements, overrides
+
+# [Content_Types].xml with an Override for each {partname: content type}
+def override_content_types(data: bytes, overrides: dict) -> bytes:
+    root = etree.fromstring(data, XML_PARSER)
+    for el in root.findall(f"{{{CT_NS}}}Override"):
+        if el.get("PartName").lstrip("/") in overrides:
+            root.remove(el)
+    for name, content_type in overrides.items():
+        etree.SubElement(root, f"{{{CT_NS}}}Override", PartName="/" + name, ContentType=content_type)
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+# docProps/core.xml with dcterms:modified set to now
+def touch_core_properties(data: bytes) -> bytes:
+    root = etree.fromstring(data, XML_PARSER)
+    modified = root.find(DCTERMS_MODIFIED)
+    if modified is None:
+        return data
+    modified.text = datetime.now(tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+# Rebrand an OOXML package in one pass over its ZIP, without loading it into an object
+# model: the mappings are applied to the elements `text_nodes` selects in the parts
+# `is_text_part` accepts, matching images under `media_prefix` are swapped, and every other part is
+# streamed across unchanged. Only text parts, package metadata and candidate media are read whole.
+def rebrand_package(uploaded_file, mappings: dict, new_logos: dict, old_logos: OldLogos,
+                    media_prefix: str, text_nodes, is_text_part, label: str):
+    pat, repl = compile_mappings(mappings)
+    raw_search = compile_raw_search(mappings)
+    output = BytesIO()
+    with zipfile.ZipFile(uploaded_file) as zin, PackageArchive(output) as zout:
+        infos = zin.infolist()
+        # only media whose header size could be a logo are read up front (WMFs are
+        # converted first, so their size says nothing); the rest is copied through below
+        media = {}
+        for info in infos:
+            name = info.filename
+            if not name.startswith(media_prefix):
+                continue
+            if not name.lower().endswith(".wmf"):
+                with zin.open(info) as fp:
+                    if not could_be_logo(image_pixels(fp), old_logos):
+                        continue
+            media[name] = zin.read(info)
+        replacements, overrides = replace_media(media, old_logos, new_logos, label)
+        for info in infos:
+            name = info.filename
+            if name in replacements:
+                data = replacements[name]
+            elif name in media:
+                data = media[name]
+            elif is_text_part(name):
+                data = zin.read(info)
+                if raw_search(data):
+                    data = replace_xml_text(data, text_nodes, pat, repl) or data
+            elif name == "[Content_Types].xml" and overrides:
+                data = override_content_types(zin.read(info), overrides)
+            elif name == "docProps/core.xml":
+                data = touch_core_properties(zin.read(info))
+            else:
+                zout.copy_entry(zin, info)
+                continue
+            zout.writestr(name, data)
+    output.seek(0)
+    return output
+
+# Parts of a .docx holding document text: the body, headers, footers and notes,
+# and the text runs in them
+DOCX_TEXT_NODES = etree.XPath("//w:t", namespaces={"w": WML_NS})
+DOCX_TEXT_PART = re.compile(r"word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml").fullmatch
+
+# Process .docx files: text replacement on the w:t runs, image replacement in word/media
+def process_docx(uploaded_file, mappings: dict, new_logos: dict, old_logos: OldLogos):
+    return rebrand_package(uploaded_file, mappings, new_logos, old_logos,
+                           "word/media/", DOCX_TEXT_NODES, DOCX_TEXT_PART, "Word")
+
+# Parts of a .xlsx holding cell text: the shared strings and the worksheets. Besides the
+# strings themselves, formulas are rewritten (string literals like ="Aecon"&A1, as
+# openpyxl's cell.value did), with the cached result of string-valued formula cells
+XLSX_TEXT_NODES = etree.XPath("//s:t | //s:c/s:f | //s:c[@t='str']/s:v", namespaces={"s": SML_NS})
+XLSX_TEXT_PART = re.compile(r"xl/(sharedStrings|worksheets/sheet\d*)\.xml").fullmatch
+
+# Process .xlsx files: cell text replacement, image replacement in xl/media
+def process_excel(uploaded_file, mappings: dict, new_logos: dict, old_logos: OldLogos):
+    return rebrand_package(uploaded_file, mappings, new_logos, old_logos,
+                           "xl/media/", XLSX_TEXT_NODES, XLSX_TEXT_PART, "Excel")
+
+# Rebrand one uploaded file; runs in a worker process when several files are uploaded,
+# with its share of the cores as phash_threads.
+# Returns the rebranded bytes (None for unsupported types) and the debug lines it logged.
+def rebrand_file(name: str, data: bytes, mappings: dict, new_logos: dict, old_logos: OldLogos,
+                 debug_on: bool, phash_threads: int):
+    log = [] if debug_on else None
+    RUN.debug_log, RUN.phash_threads = log, phash_threads
+    try:
+        ext = name.split('.')[-1].lower()
+        if ext == 'docx':
+            out = process_docx(BytesIO(data), mappings, new_logos, old_logos)
+        elif ext == 'pptx':
+            out = process_pptx(BytesIO(data), mappings, new_logos, old_logos)
+        elif ext in ('xlsx','xlsm'):
+            out = process_excel(BytesIO(data), mappings, new_logos, old_logos)
+        else:
+            out = None
+    finally:
+        del RUN.debug_log, RUN.phash_threads
+    return (None if out is None else out.getvalue()), log or []
+
+# Worker processes for multi-file batches, kept alive across reruns. "spawn" avoids forking
+# the multi-threaded Streamlit server.
+@st.cache_resource(show_spinner=False)
+def process_pool():
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
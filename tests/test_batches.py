@@ -0,0 +1,68 @@
+import tempfile
+import unittest
+from io import BytesIO
+from pathlib import Path
+
+from pptx import Presentation
+from streamlit.testing.v1 import AppTest
+
+APP = Path(__file__).resolve().parent.parent / "app.py"
+
+# Runs app.py the way `streamlit run` does (a fresh __main__ module per rerun), with the
+# uploaders returning the files in FIXTURES and the rebrand button pressed
+SCRIPT = f"""
+import io, pathlib, streamlit as st
+FIXTURES = {{fixtures!r}}
+
+class Upload(io.BytesIO):
+    def __init__(self, path):
+        super().__init__(pathlib.Path(path).read_bytes())
+        self.name = path.rsplit("/", 1)[-1]
+
+def file_uploader(label, type=None, accept_multiple_files=False, **kwargs):
+    if accept_multiple_files:
+        return [Upload(path) for path in FIXTURES["documents"]]
+    return Upload(FIXTURES["logo"])
+
+st.file_uploader = file_uploader
+st.button = lambda *args, **kwargs: True
+__file__ = {str(APP)!r}
+exec(compile(pathlib.Path(__file__).read_text(), __file__, "exec"))
+"""
+
+
+class MultiFileBatchTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.fixtures = {"logo": self.make_logo(tmp.name), "documents": []}
+        for i in range(2):
+            prs = Presentation()
+            slide = prs.slides.add_slide(prs.slide_layouts[5])
+            slide.shapes.title.text = f"Aecon deck {i}"
+            path = f"{tmp.name}/deck{i}.pptx"
+            prs.save(path)
+            self.fixtures["documents"].append(path)
+
+    @staticmethod
+    def make_logo(directory):
+        from PIL import Image
+        path = f"{directory}/logo.png"
+        Image.new("RGB", (200, 80), (0, 128, 255)).save(path)
+        return path
+
+    # Every rerun re-executes app.py into a new __main__ module; batches sent to the
+    # worker processes must keep working after the first run
+    def test_batch_on_consecutive_runs(self):
+        at = AppTest.from_string(SCRIPT.format(fixtures=self.fixtures), default_timeout=120)
+        for run in range(2):
+            at.run()
+            with self.subTest(run=run):
+                self.assertEqual([e.value for e in at.exception], [])
+                labels = [b.proto.label for b in at.get("download_button")]
+                self.assertIn("📄 rebranded_deck0.pptx", labels)
+                self.assertIn("📄 rebranded_deck1.pptx", labels)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+from io import BytesIO
+
+from PIL import Image
+
+import rebrander
+
+
+def encode(img, fmt, **params):
+    buf = BytesIO()
+    img.save(buf, fmt, **params)
+    return buf.getvalue()
+
+
+class MatchAllTest(unittest.TestCase):
+    def setUp(self):
+        self.old_logos = rebrander.load_old_logo_hashes(rebrander.old_logo_signature())
+        self.logo = Image.open(rebrander.OLD_LOGO_DIR / "logo_1.PNG")
+        self.logo.load()
+
+    def assertMatches(self, blob):
+        dist = rebrander.match_all([blob], self.old_logos)[blob]
+        self.assertIsNotNone(dist)
+        self.assertLessEqual(dist, rebrander.HASH_THRESHOLD)
+
+    # phash doesn't care about scale or encoding, so neither may the pre-filters
+    def test_upscaled_logo_matches(self):
+        w, h = self.logo.size
+        self.assertMatches(encode(self.logo.resize((w * 3, h * 3), Image.LANCZOS), "PNG"))
+
+    def test_jpeg_thumbnail_matches(self):
+        w, h = self.logo.size
+        thumb = self.logo.convert("RGB").resize((w // 3, h // 3), Image.LANCZOS)
+        self.assertMatches(encode(thumb, "JPEG", quality=60))
+
+    def test_photo_sized_image_is_skipped(self):
+        w, h = self.logo.size
+        scale = rebrander.SCALE_LIMIT + 1
+        photo = encode(self.logo.convert("RGB").resize((w * scale, h * scale)), "JPEG")
+        self.assertIsNone(rebrander.match_all([photo], self.old_logos)[photo])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+import zipfile
+from io import BytesIO
+
+from lxml import etree
+from PIL import Image
+
+import rebrander
+
+W = f'xmlns:w="{rebrander.WML_NS}"'
+S = f'xmlns="{rebrander.SML_NS}"'
+CT = rebrander.CT_NS
+XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+MAPPINGS = {"Aecon Group Inc.": "North End Connectors", "Aecon": "NEC", " Inc.": " ", "2023": "2024"}
+
+CORE = (
+    XML_DECL + '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties"'
+    ' xmlns:dcterms="http://purl.org/dc/terms/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+    '<dcterms:modified xsi:type="dcterms:W3CDTF">2020-01-01T00:00:00Z</dcterms:modified></cp:coreProperties>'
+)
+
+DOCUMENT = XML_DECL + f"""<w:document {W}><w:body>
+<w:p><w:r><w:t>Welcome to Aecon Group Inc.</w:t></w:r></w:p>
+<w:tbl><w:tr><w:tc><w:p><w:r><w:t>Aecon cell</w:t></w:r></w:p></w:tc></w:tr></w:tbl>
+<w:p><w:r><w:pict><w:txbxContent><w:p><w:r><w:t>Textbox Aecon</w:t></w:r></w:p></w:txbxContent></w:pict></w:r></w:p>
+<w:p><w:r><w:t>Acme Inc.</w:t></w:r></w:p>
+</w:body></w:document>"""
+
+HEADER = XML_DECL + f"<w:hdr {W}><w:p><w:r><w:t>Aecon header</w:t></w:r></w:p></w:hdr>"
+
+SHARED_STRINGS = XML_DECL + f'<sst {S} count="1" uniqueCount="1"><si><t>Aecon Group Inc.</t></si></sst>'
+
+SHEET = XML_DECL + f"""<worksheet {S}><sheetData>
+<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1"><v>2023</v></c></row>
+<row r="2"><c r="A2" t="str"><f>CONCATENATE("Aecon"," ",A1)</f><v>Aecon x</v></c><c r="B2"><f>B1+2023</f><v>4046</v></c></row>
+</sheetData></worksheet>"""
+
+
+def content_types(*defaults):
+    entries = "".join(f'<Default Extension="{ext}" ContentType="{ct}"/>' for ext, ct in defaults)
+    return XML_DECL + f'<Types xmlns="{CT}">{entries}</Types>'
+
+
+def package(parts):
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in parts.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def encode(img, fmt):
+    buf = BytesIO()
+    img.save(buf, fmt)
+    return buf.getvalue()
+
+
+class RebrandFileTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        old_logo = Image.open(rebrander.OLD_LOGO_DIR / "logo_1.PNG")
+        cls.old_logo_gif = encode(old_logo, "GIF")
+        cls.new_logos = rebrander.logo_variants(encode(Image.new("RGB", (200, 80), (0, 128, 255)), "PNG"))
+        cls.old_logos = rebrander.with_new_logo(
+            rebrander.load_old_logo_hashes(rebrander.old_logo_signature()), cls.new_logos
+        )
+        cls.docx = package({
+            "[Content_Types].xml": content_types(("xml", "application/xml"), ("gif", "image/gif")),
+            "word/document.xml": DOCUMENT,
+            "word/header1.xml": HEADER,
+            "word/media/image1.gif": cls.old_logo_gif,
+            "word/embeddings/oleObject1.bin": b"Aecon" * 100,
+            "docProps/core.xml": CORE,
+        })
+        cls.xlsx = package({
+            "[Content_Types].xml": content_types(("xml", "application/xml")),
+            "xl/sharedStrings.xml": SHARED_STRINGS,
+            "xl/worksheets/sheet1.xml": SHEET,
+        })
+
+    def rebrand(self, name, data):
+        out, log = rebrander.rebrand_file(name, data, MAPPINGS, self.new_logos, self.old_logos, True, 1)
+        return zipfile.ZipFile(BytesIO(out)), log
+
+    def texts(self, zf, part, path, ns):
+        return [el.text for el in etree.fromstring(zf.read(part)).xpath(path, namespaces=ns)]
+
+    def test_docx_text(self):
+        zf, _ = self.rebrand("doc.docx", self.docx)
+        w = {"w": rebrander.WML_NS}
+        self.assertEqual(
+            self.texts(zf, "word/document.xml", "//w:t", w),
+            ["Welcome to North End Connectors", "NEC cell", "Textbox NEC", "Acme "],
+        )
+        self.assertEqual(self.texts(zf, "word/header1.xml", "//w:t", w), ["NEC header"])
+        # embedded objects are opaque: copied through, never rewritten
+        self.assertEqual(zf.read("word/embeddings/oleObject1.bin"), b"Aecon" * 100)
+
+    # Word drops edge whitespace of a w:t unless it is marked xml:space="preserve"
+    def test_docx_edge_whitespace_is_preserved(self):
+        zf, _ = self.rebrand("doc.docx", self.docx)
+        root = etree.fromstring(zf.read("word/document.xml"))
+        spaces = {el.text: el.get(rebrander.XML_SPACE) for el in root.iter(rebrander.WML_T)}
+        self.assertEqual(spaces["Acme "], "preserve")
+        self.assertIsNone(spaces["NEC cell"])
+
+    def test_xlsx_cells(self):
+        zf, _ = self.rebrand("book.xlsx", self.xlsx)
+        s = {"s": rebrander.SML_NS}
+        self.assertEqual(self.texts(zf, "xl/sharedStrings.xml", "//s:t", s), ["North End Connectors"])
+        sheet = "xl/worksheets/sheet1.xml"
+        self.assertEqual(
+            self.texts(zf, sheet, "//s:f", s),
+            ['CONCATENATE("NEC"," ",A1)', "B1+2024"],
+        )
+        # the cached result of a string formula is text; numeric values are not
+        self.assertEqual(self.texts(zf, sheet, "//s:c[@t='str']/s:v", s), ["NEC x"])
+        self.assertEqual(self.texts(zf, sheet, "//s:c[not(@t)]/s:v", s), ["2023", "4046"])
+
+    # A GIF logo is replaced by the PNG variant, so its part needs a PNG content type
+    def test_image_swap_overrides_content_type(self):
+        zf, log = self.rebrand("doc.docx", self.docx)
+        self.assertEqual(zf.read("word/media/image1.gif"), self.new_logos["image/png"])
+        self.assertTrue(any("Replacing Word image 'word/media/image1.gif'" in line for line in log))
+        root = etree.fromstring(zf.read("[Content_Types].xml"))
+        overrides = {el.get("PartName"): el.get("ContentType") for el in root.iter(f"{{{CT}}}Override")}
+        self.assertEqual(overrides, {"/word/media/image1.gif": "image/png"})
+
+    def test_second_pass_changes_nothing(self):
+        for name, data in (("doc.docx", self.docx), ("book.xlsx", self.xlsx)):
+            with self.subTest(name=name):
+                first, _ = self.rebrand(name, data)
+                second, log = self.rebrand(name, first.fp.getvalue())
+                self.assertEqual(first.namelist(), second.namelist())
+                for part in first.namelist():
+                    if part != "docProps/core.xml":
+                        self.assertEqual(first.read(part), second.read(part), part)
+                self.assertFalse([line for line in log if line.startswith("Replacing")])
+
+
+if __name__ == "__main__":
+    unittest.main()